@@ -1,16 +1,29 @@
 # %% Pakete
 import os
 import re
+import time
+from collections.abc import Callable
+import difflib
+import diskcache
+from langchain_core.messages import SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
-from pydantic import BaseModel, Field
+from langchain_core.output_parsers import JsonOutputParser, PydanticOutputParser
+from pydantic import BaseModel, Field, PrivateAttr
 from langchain_groq import ChatGroq
 
 import dash
-from dash import dcc, html, Input, Output, State, callback
+from dash import dcc, html, Input, Output, State, callback, DiskcacheManager
 import dash_bootstrap_components as dbc
+import plotly.io as pio
 
 os.environ.get('MY_API_KEY')
+
+# Alle Caches liegen hier, damit sie Neustarts und Hot-Reloads (debug=True) überstehen
+CACHE_DIR = os.environ.get(
+    "REZEPT_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+os.makedirs(CACHE_DIR, exist_ok=True)
+
 # ── Supermarkt-Abteilungen in typischer Laufreihenfolge ──────────────────────
 SUPERMARKT_REIHENFOLGE = [
     "Obst & Gemüse",
@@ -42,7 +55,29 @@ ABTEILUNG_ICONS = {
     "Sonstiges": "🛒",
 }
 
+# (Position in der Laufreihenfolge, Icon) je Abteilung
+ABTEILUNG_META = {name: (i, ABTEILUNG_ICONS[name]) for i, name in enumerate(SUPERMARKT_REIHENFOLGE)}
+_DEFAULT_META = (99, "🛒")
+
 # ── Pydantic-Modelle (erweitertes Schema) ─────────────────────────────────────
+# Zahl: "200", "0,5", "1.5", "1.000" (Tausenderpunkt), "1/2", "1 1/2"
+_ZAHL = r"\d+(?:\s+\d+/[1-9]\d*|/[1-9]\d*|(?:\.\d{3})+(?!\d)|[.,]\d+)?"
+# Optionaler Vorsatz ohne Ziffern ("ca. "), Zahl oder Spanne ("2-3"), Einheit
+_MENGE_RE = re.compile(
+    rf"^(\D*?)({_ZAHL})(?:\s*[-–]\s*({_ZAHL}))?(?!\s*[\d/.,\-–])\s*(.*)$"
+)
+
+
+def _parse_zahl(text: str) -> float:
+    if "/" in text:
+        ganz, _, bruch = text.rpartition(" ")
+        zaehler, nenner = bruch.split("/")
+        return (float(ganz) if ganz else 0.0) + int(zaehler) / int(nenner)
+    if re.fullmatch(r"\d+(?:\.\d{3})+", text):
+        return float(text.replace(".", ""))
+    return float(text.replace(",", "."))
+
+
 class Zutat(BaseModel):
     name: str = Field(description="Name der Zutat")
     menge: str = Field(description="Benötigte Menge, z.B. '200 g', '2 Stück', '1 EL'")
@@ -55,6 +90,21 @@ class Zutat(BaseModel):
     preis_eur: float = Field(
         description="Geschätzter aktueller Einzelhandelspreis in Euro (Deutschland 2025) für die angegebene Menge"
     )
+    # Aus `menge` geparst, z.B. "ca. 2-3 Zehen" -> ("ca. ", 2.0, 3.0, "Zehen");
+    # _wert bleibt None bei "nach Belieben"
+    _vorsatz: str = PrivateAttr(default="")
+    _wert: float | None = PrivateAttr(default=None)
+    _wert_bis: float | None = PrivateAttr(default=None)
+    _einheit: str = PrivateAttr(default="")
+
+    def model_post_init(self, __context) -> None:
+        treffer = _MENGE_RE.match(self.menge)
+        if treffer:
+            vorsatz, von, bis, einheit = treffer.groups()
+            self._vorsatz = vorsatz
+            self._wert = _parse_zahl(von)
+            self._wert_bis = _parse_zahl(bis) if bis else None
+            self._einheit = einheit
 
 
 class RezeptAusgabe(BaseModel):
@@ -71,6 +121,7 @@ class RezeptAusgabe(BaseModel):
 
 # ── LangChain-Chain ───────────────────────────────────────────────────────────
 parser = PydanticOutputParser(pydantic_object=RezeptAusgabe)
+_FORMAT_INSTRUCTIONS = parser.get_format_instructions()
 
 SYSTEM_PROMPT = """\
 Du bist ein erfahrener Koch und Einkaufsexperte für den deutschen Markt.
@@ -82,66 +133,260 @@ Der Nutzer nennt dir ein Gericht. Du erstellst:
 
 {schema}"""
 
+# Der System-Prompt wird einmalig fertig gerendert und als Nachricht (nicht als
+# Template) übergeben: pro Aufruf wird nur noch {gericht} eingesetzt, und der
+# Präfix bleibt byte-identisch für Prompt-Caching beim Anbieter.
 prompt_template = ChatPromptTemplate.from_messages([
-    ("system", SYSTEM_PROMPT),
+    SystemMessage(content=SYSTEM_PROMPT.format(schema=_FORMAT_INSTRUCTIONS)),
     ("user", "Erstelle ein detailliertes Rezept für: {gericht}"),
-]).partial(schema=parser.get_format_instructions())
+])
 
 model = ChatGroq(model="openai/gpt-oss-120b")
-chain = prompt_template | model | parser
+# Beim Streamen liefert der JsonOutputParser teilweise befüllte Dicts; gegen
+# RezeptAusgabe validiert wird erst die vollständige Antwort. stream() umgeht
+# LangChains LLM-Cache, zwischengespeichert wird daher nur über rezept_cache.
+chain = prompt_template | model | JsonOutputParser()
+
+
+def rezept_streamen(gericht: str, bei_vorschau: Callable[[dict], None]) -> RezeptAusgabe:
+    """Streamt die LLM-Antwort und meldet Titel/Kurzbeschreibung, sobald sie vorliegen."""
+    teil: dict = {}
+    vorschau = None
+    for teil in chain.stream({"gericht": gericht}):
+        neu = (teil.get("titel"), teil.get("kurzbeschreibung"))
+        if neu != vorschau:
+            vorschau = neu
+            bei_vorschau(teil)
+    return RezeptAusgabe.model_validate(teil)
+
+
+# ── Rezept-Cache für (nahezu) gleiche Gerichte ────────────────────────────────
+# Auf der Platte statt im Speicher, damit alle gunicorn-Worker denselben Cache nutzen.
+# Gespeichert werden bereits validierte Rezepte als dict; beim Laden wird daher
+# ohne erneute Validierung konstruiert.
+rezept_cache = diskcache.Cache(os.path.join(CACHE_DIR, "rezepte"))
+AEHNLICHKEIT_SCHWELLE = 0.92
+
+# Wort -> zuletzt gespeicherte Schlüssel mit diesem Wort. Begrenzt die Kandidaten
+# für den Ähnlichkeitsvergleich, statt bei jedem Fehltreffer alle Schlüssel zu laden.
+rezept_index = diskcache.Cache(os.path.join(CACHE_DIR, "rezept_index"))
+_MAX_KANDIDATEN_JE_WORT = 50
+
+
+def _cache_schluessel(gericht: str) -> str:
+    """Normalisiert ein Gericht, sodass Wortreihenfolge und Satzzeichen egal sind."""
+    return " ".join(sorted(re.findall(r"\w+", gericht.lower())))
+
+
+def rezept_aus_cache(gericht: str) -> RezeptAusgabe | None:
+    """Liefert ein gespeichertes Rezept für dasselbe oder ein fast gleich geschriebenes Gericht.
+
+    Wortreihenfolge, Groß-/Kleinschreibung und Satzzeichen spielen keine Rolle;
+    darüber hinaus werden nur kleine Abweichungen wie Tippfehler oder Plural
+    erkannt ("spagetti carbonara"). Ein Teilname wie "carbonara" trifft
+    "spaghetti carbonara" dagegen nicht, und Gerichte mit anderen Zahlen
+    ("Muffins für 12 Stück" vs. "für 24 Stück") gelten nie als ähnlich.
+    """
+    schluessel = _cache_schluessel(gericht)
+    gespeichert = rezept_cache.get(schluessel)
+    if gespeichert is None:
+        zahlen = sorted(re.findall(r"\d+", schluessel))
+        kandidaten = {
+            k
+            for wort in schluessel.split()
+            for k in rezept_index.get(wort, ())
+            if sorted(re.findall(r"\d+", k)) == zahlen
+        }
+        treffer = difflib.get_close_matches(
+            schluessel, kandidaten, n=1, cutoff=AEHNLICHKEIT_SCHWELLE
+        )
+        if not treffer:
+            return None
+        gespeichert = rezept_cache.get(treffer[0])
+        if gespeichert is None:
+            return None
+    # Nur für eigene Cache-Inhalte! LLM-Antworten müssen immer validiert werden.
+    return RezeptAusgabe.model_construct(**{
+        **gespeichert,
+        "zutaten": [Zutat.model_construct(**z) for z in gespeichert["zutaten"]],
+    })
+
+
+def rezept_speichern(gericht: str, rezept: RezeptAusgabe) -> None:
+    schluessel = _cache_schluessel(gericht)
+    rezept_cache.set(schluessel, rezept.model_dump())
+    with rezept_index.transact():
+        for wort in set(schluessel.split()):
+            andere = [k for k in rezept_index.get(wort, ()) if k != schluessel]
+            rezept_index.set(wort, [schluessel, *andere][:_MAX_KANDIDATEN_JE_WORT])
+
+
+# Laufende Generierungen je Gericht (Wert: aktuelle Vorschau). Eigener Cache,
+# damit die Einträge nicht als Rezepte gelesen werden.
+rezept_in_arbeit = diskcache.Cache(os.path.join(CACHE_DIR, "in_arbeit"))
+_IN_ARBEIT_ABLAUF_S = 300
+_WARTE_INTERVALL_S = 0.3
+
+
+def rezept_holen(
+    grundgericht: str, gericht: str, bei_vorschau: Callable[[dict], None]
+) -> RezeptAusgabe:
+    """Liefert das Rezept aus dem Cache oder erzeugt es per LLM.
+
+    Gleichzeitige Anfragen für dasselbe Gericht teilen sich einen LLM-Aufruf:
+    Wer zuerst kommt, erzeugt das Rezept; alle anderen fragen in Abständen den
+    Cache ab und zeigen solange die Vorschau der laufenden Generierung.
+    """
+    schluessel = _cache_schluessel(grundgericht)
+    while True:
+        rezept = rezept_aus_cache(grundgericht)
+        if rezept is not None:
+            return rezept
+        if rezept_in_arbeit.add(schluessel, {}, expire=_IN_ARBEIT_ABLAUF_S):
+            break
+        # Warten, bis die andere Anfrage fertig ist oder ihr Eintrag abläuft;
+        # scheitert sie, übernimmt die nächste Runde die Generierung selbst.
+        vorschau = None
+        while (teil := rezept_in_arbeit.get(schluessel)) is not None:
+            if teil != vorschau:
+                vorschau = teil
+                bei_vorschau(teil)
+            time.sleep(_WARTE_INTERVALL_S)
+
+    def vorschau_teilen(teil: dict) -> None:
+        kurz = {"titel": teil.get("titel"), "kurzbeschreibung": teil.get("kurzbeschreibung")}
+        rezept_in_arbeit.set(schluessel, kurz, expire=_IN_ARBEIT_ABLAUF_S)
+        bei_vorschau(kurz)
+
+    try:
+        rezept = rezept_streamen(gericht, vorschau_teilen)
+        rezept_speichern(grundgericht, rezept)
+        return rezept
+    finally:
+        rezept_in_arbeit.delete(schluessel)
+
+
+# ── Portionen umrechnen statt neu generieren ──────────────────────────────────
+_PORTIONEN_RE = re.compile(
+    r"\s*f(?:ü|ue)r\s+(\d+)\s*(?:person(?:en)?|portion(?:en)?|pers\.?)(?!\w)", re.IGNORECASE
+)
+
+
+def trenne_portionen(gericht: str) -> tuple[str, int | None]:
+    """Zerlegt z.B. "Carbonara für 6 Personen" in ("Carbonara", 6)."""
+    treffer = _PORTIONEN_RE.search(gericht)
+    if not treffer or int(treffer.group(1)) <= 0:
+        return gericht, None
+    return _PORTIONEN_RE.sub("", gericht, count=1).strip(), int(treffer.group(1))
+
+
+def _formatiere_zahl(wert: float) -> str:
+    return f"{wert:.2f}".rstrip("0").rstrip(".").replace(".", ",")
+
+
+def _skaliere_menge(zutat: Zutat, faktor: float) -> str:
+    if zutat._wert is None:
+        return zutat.menge  # z.B. "nach Belieben"
+    zahl = _formatiere_zahl(zutat._wert * faktor)
+    if zutat._wert_bis is not None:
+        zahl += "-" + _formatiere_zahl(zutat._wert_bis * faktor)
+    return f"{zutat._vorsatz}{zahl} {zutat._einheit}".strip()
+
+
+def skaliere_rezept(basis: RezeptAusgabe, portionen: int) -> RezeptAusgabe | None:
+    """Rechnet Mengen und Preise eines Rezepts auf eine neue Portionenzahl um.
+
+    Gibt None zurück, wenn eine Menge Zahlen enthält, die sich nicht sicher
+    umrechnen lassen; sonst stünden umgerechnete Preise neben alten Mengen.
+    """
+    if portionen == basis.portionen or basis.portionen <= 0:
+        return basis
+    if any(z._wert is None and re.search(r"\d", z.menge) for z in basis.zutaten):
+        return None
+    faktor = portionen / basis.portionen
+    # Neu konstruieren statt model_copy, damit die geparsten Werte zur neuen Menge passen
+    zutaten = [
+        Zutat(
+            name=z.name,
+            menge=_skaliere_menge(z, faktor),
+            abteilung=z.abteilung,
+            preis_eur=round(z.preis_eur * faktor, 2),
+        )
+        for z in basis.zutaten
+    ]
+    return basis.model_copy(update={"zutaten": zutaten, "portionen": portionen})
 
 
 # ── Hilfsfunktionen für die UI ────────────────────────────────────────────────
+_STEP_PREFIX_RE = re.compile(r"^\d+[\.\)]\s*")
+
+# Gemeinsam genutzte Styles der Einkaufsliste (nicht pro Zeile neu anlegen)
+_STYLE_ABT_HEADER = {
+    "backgroundColor": "#e8f5e9",
+    "padding": "6px 12px",
+    "fontSize": "0.9rem",
+    "letterSpacing": "0.03em",
+}
+_STYLE_ITEM_NAME = {"paddingLeft": "2rem"}
+_STYLE_PRICE = {"whiteSpace": "nowrap"}
+_STYLE_TOTAL = {"borderTop": "2px solid #4caf50"}
+
+# Statische Teile der Ergebnisansicht, einmalig gebaut
+_EINKAUFSLISTE_THEAD = html.Thead(
+    html.Tr([
+        html.Th("Zutat", style={"width": "50%"}),
+        html.Th("Menge", style={"width": "25%"}),
+        html.Th("Preis", className="text-end", style={"width": "25%"}),
+    ])
+)
+_EINKAUFSLISTE_HEADER_H5 = html.H5(
+    ["🛒 ", html.Span("Einkaufsliste", className="ms-1")],
+    className="mb-3 text-success fw-bold",
+)
+_ZUBEREITUNG_HEADER_H5 = html.H5(
+    ["📋 ", html.Span("Zubereitung", className="ms-1")],
+    className="mb-3 text-primary fw-bold",
+)
+
+
 def erstelle_einkaufsliste(zutaten: list[Zutat]) -> dbc.Table:
     """Baut eine nach Supermarkt-Abteilungen sortierte Einkaufsliste als Tabelle."""
-    # Nach Abteilung gruppieren
-    gruppen: dict[str, list[Zutat]] = {}
-    for z in zutaten:
-        gruppen.setdefault(z.abteilung, []).append(z)
-
-    # Sortierung nach typischer Supermarkt-Reihenfolge
-    sortierte_gruppen = sorted(
-        gruppen.items(),
-        key=lambda x: (
-            SUPERMARKT_REIHENFOLGE.index(x[0])
-            if x[0] in SUPERMARKT_REIHENFOLGE
-            else 99
-        ),
+    # Sortierung nach typischer Supermarkt-Reihenfolge; innerhalb einer
+    # Abteilung bleibt die Reihenfolge des Rezepts erhalten
+    sortierte_zutaten = sorted(
+        ((ABTEILUNG_META.get(z.abteilung, _DEFAULT_META), z) for z in zutaten),
+        key=lambda x: (x[0][0], x[1].abteilung),
     )
 
     zeilen = []
     gesamt = 0.0
+    aktuelle_abteilung = None
 
-    for abteilung, artikel in sortierte_gruppen:
-        icon = ABTEILUNG_ICONS.get(abteilung, "🛒")
-        # Abteilungs-Header
-        zeilen.append(
-            html.Tr(
-                html.Td(
-                    [html.Span(icon, className="me-2"), html.Strong(abteilung)],
-                    colSpan=3,
-                    style={
-                        "backgroundColor": "#e8f5e9",
-                        "padding": "6px 12px",
-                        "fontSize": "0.9rem",
-                        "letterSpacing": "0.03em",
-                    },
-                )
-            )
-        )
-        for z in artikel:
-            gesamt += z.preis_eur
+    for (_, icon), z in sortierte_zutaten:
+        if z.abteilung != aktuelle_abteilung:
+            aktuelle_abteilung = z.abteilung
+            # Abteilungs-Header
             zeilen.append(
-                html.Tr([
-                    html.Td(z.name, style={"paddingLeft": "2rem"}),
-                    html.Td(z.menge, className="text-muted small"),
+                html.Tr(
                     html.Td(
-                        f"{z.preis_eur:.2f} €",
-                        className="text-end fw-semibold",
-                        style={"whiteSpace": "nowrap"},
-                    ),
-                ])
+                        [html.Span(icon, className="me-2"), html.Strong(z.abteilung)],
+                        colSpan=3,
+                        style=_STYLE_ABT_HEADER,
+                    )
+                )
             )
+        gesamt += z.preis_eur
+        zeilen.append(
+            html.Tr([
+                html.Td(z.name, style=_STYLE_ITEM_NAME),
+                html.Td(z.menge, className="text-muted small"),
+                html.Td(
+                    f"{z.preis_eur:.2f} €",
+                    className="text-end fw-semibold",
+                    style=_STYLE_PRICE,
+                ),
+            ])
+        )
 
     # Gesamtzeile
     zeilen.append(
@@ -153,19 +398,13 @@ def erstelle_einkaufsliste(zutaten: list[Zutat]) -> dbc.Table:
                     className="text-end text-success fs-6",
                 ),
             ],
-            style={"borderTop": "2px solid #4caf50"},
+            style=_STYLE_TOTAL,
         )
     )
 
     return dbc.Table(
         [
-            html.Thead(
-                html.Tr([
-                    html.Th("Zutat", style={"width": "50%"}),
-                    html.Th("Menge", style={"width": "25%"}),
-                    html.Th("Preis", className="text-end", style={"width": "25%"}),
-                ])
-            ),
+            _EINKAUFSLISTE_THEAD,
             html.Tbody(zeilen),
         ],
         bordered=True,
@@ -178,14 +417,27 @@ def erstelle_einkaufsliste(zutaten: list[Zutat]) -> dbc.Table:
 
 def erstelle_zubereitung(zubereitung: str) -> html.Ol:
     """Formatiert nummerierte Zubereitungsschritte als geordnete Liste."""
-    schritte = [s.strip() for s in zubereitung.splitlines() if s.strip()]
-    items = []
-    for schritt in schritte:
-        bereinigt = re.sub(r"^\d+[\.\)]\s*", "", schritt)
-        items.append(html.Li(bereinigt, className="mb-2"))
+    items = [
+        html.Li(_STEP_PREFIX_RE.sub("", schritt), className="mb-2")
+        for zeile in zubereitung.splitlines()
+        if (schritt := zeile.strip())
+    ]
     return html.Ol(items, className="ps-3 mb-0")
 
 
+def erstelle_vorschau(teil: dict) -> dbc.Card | None:
+    """Zeigt Titel und Kurzbeschreibung, während der Rest noch generiert wird."""
+    if not teil.get("titel"):
+        return None
+    return dbc.Card(
+        dbc.CardBody([
+            html.H2(teil["titel"], className="fw-bold mb-1"),
+            html.P(teil.get("kurzbeschreibung") or "", className="text-muted mb-0"),
+        ]),
+        className="shadow-sm mb-4",
+    )
+
+
 def erstelle_ergebnis(rezept: RezeptAusgabe) -> html.Div:
     """Baut die vollständige Ergebnisansicht."""
     schwierigkeit_farbe = {
@@ -235,18 +487,12 @@ def erstelle_ergebnis(rezept: RezeptAusgabe) -> html.Div:
         # ── Einkaufsliste + Zubereitung ────────────────────────────────────
         dbc.Row([
             dbc.Col([
-                html.H5(
-                    ["🛒 ", html.Span("Einkaufsliste", className="ms-1")],
-                    className="mb-3 text-success fw-bold",
-                ),
+                _EINKAUFSLISTE_HEADER_H5,
                 erstelle_einkaufsliste(rezept.zutaten),
             ], md=6, className="mb-4"),
 
             dbc.Col([
-                html.H5(
-                    ["📋 ", html.Span("Zubereitung", className="ms-1")],
-                    className="mb-3 text-primary fw-bold",
-                ),
+                _ZUBEREITUNG_HEADER_H5,
                 dbc.Card(
                     dbc.CardBody(erstelle_zubereitung(rezept.zubereitung)),
                     className="shadow-sm",
@@ -269,6 +515,15 @@ def _zeitblock(icon: str, label: str, minuten: int, bold: bool = False) -> html.
 
 
 # ── Dash App ──────────────────────────────────────────────────────────────────
+# Dash serialisiert Callback-Antworten über den JSON-Encoder von plotly; hier wird
+# dessen orjson-Engine fest eingestellt statt automatisch gewählt. Ein
+# Geschwindigkeitsgewinn für Komponentenbäume ist nicht gemessen.
+pio.json.config.default_engine = "orjson"
+
+# Rezepte laufen als Hintergrund-Callback, damit Zwischenstände per Progress
+# schon während der Generierung im Browser ankommen.
+background_callback_manager = DiskcacheManager(diskcache.Cache(os.path.join(CACHE_DIR, "dash")))
+
 app = dash.Dash(
     __name__,
     external_stylesheets=[
@@ -276,6 +531,7 @@ app = dash.Dash(
         "https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css",
     ],
     title="Rezept & Einkaufsplaner",
+    background_callback_manager=background_callback_manager,
 )
 
 app.layout = dbc.Container(
@@ -332,6 +588,11 @@ app.layout = dbc.Container(
             className="shadow-sm mb-4",
         ),
 
+        # ── Vorschau während der Generierung ──────────────────────────────
+        html.Div(id="vorschau-container"),
+        dcc.Store(id="last-recipe-key"),
+        dcc.Store(id="rezept-anfrage"),
+
         # ── Ergebnis mit Ladeanzeige ───────────────────────────────────────
         dcc.Loading(
             html.Div(id="ergebnis-container"),
@@ -344,26 +605,73 @@ app.layout = dbc.Container(
 )
 
 
-# ── Callback ──────────────────────────────────────────────────────────────────
+# ── Callbacks ─────────────────────────────────────────────────────────────────
 @callback(
-    Output("ergebnis-container", "children"),
+    Output("rezept-anfrage", "data"),
     Input("submit-btn", "n_clicks"),
     Input("gericht-input", "n_submit"),
     State("gericht-input", "value"),
+    State("last-recipe-key", "data"),
+    prevent_initial_call=True,
+)
+def rezept_anfragen(n_clicks, n_submit, gericht, letzter_schluessel):
+    """Startet die Generierung nur, wenn nicht bereits dasselbe Gericht angezeigt wird.
+
+    Läuft als normaler Callback, damit ein erneutes Absenden keinen Hintergrund-Job
+    startet. Die laufende Nummer sorgt dafür, dass auch gleiche Anfragen (z.B. nach
+    einem Fehler) den Hintergrund-Callback erneut auslösen.
+    """
+    # Normalisieren, damit "Carbonara " und "carbonara" denselben Cache-Eintrag treffen
+    gericht = (gericht or "").strip().lower()
+    if gericht and gericht == letzter_schluessel:
+        return dash.no_update
+    return {"gericht": gericht, "nr": (n_clicks or 0) + (n_submit or 0)}
+
+
+@callback(
+    Output("ergebnis-container", "children"),
+    Output("last-recipe-key", "data"),
+    Input("rezept-anfrage", "data"),
+    background=True,
+    progress=[Output("vorschau-container", "children")],
+    running=[
+        (Output("vorschau-container", "style"), {"display": "block"}, {"display": "none"}),
+        (Output("submit-btn", "disabled"), True, False),
+        (Output("gericht-input", "disabled"), True, False),
+    ],
     prevent_initial_call=True,
 )
-def rezept_erstellen(n_clicks, n_submit, gericht):
-    if not gericht or not gericht.strip():
-        return dbc.Alert("Bitte geben Sie zunächst ein Gericht ein.", color="warning", className="mt-2")
+def rezept_erstellen(set_progress, anfrage):
+    gericht = anfrage["gericht"]
+    grundgericht, portionen = trenne_portionen(gericht)
+    # Auch "für 4 Personen" oder "???" allein enthalten kein Gericht; sonst würde
+    # unter dem leeren Schlüssel ein beliebiges Rezept gespeichert und wiederverwendet.
+    if not _cache_schluessel(grundgericht):
+        return (
+            dbc.Alert("Bitte geben Sie zunächst ein Gericht ein.", color="warning", className="mt-2"),
+            None,
+        )
+
+    # Vorschau des vorherigen Gerichts entfernen, auch wenn gleich ein Cache-Treffer folgt
+    set_progress([None])
 
     try:
-        rezept: RezeptAusgabe = chain.invoke({"gericht": gericht.strip()})
-        return erstelle_ergebnis(rezept)
+        def bei_vorschau(teil: dict) -> None:
+            set_progress([erstelle_vorschau(teil)])
+
+        rezept = rezept_holen(grundgericht, gericht, bei_vorschau)
+        if portionen:
+            # Nicht sicher umrechenbar: für die gewünschte Portionenzahl neu generieren
+            rezept = skaliere_rezept(rezept, portionen) or rezept_streamen(gericht, bei_vorschau)
+        return erstelle_ergebnis(rezept), gericht
     except Exception as exc:
-        return dbc.Alert(
-            [html.Strong("Fehler beim Abrufen des Rezepts: "), str(exc)],
-            color="danger",
-            className="mt-2",
+        return (
+            dbc.Alert(
+                [html.Strong("Fehler beim Abrufen des Rezepts: "), str(exc)],
+                color="danger",
+                className="mt-2",
+            ),
+            None,
         )
 
 